@@ -1,22 +1,25 @@
 """
-HTTP API for RAG: /query, /ingest/url, /ingest/document (PDF/DOCX), /health.
+HTTP API for RAG: /query, /query/stream, /ingest/url, /ingest/document (PDF/DOCX), /health.
 """
 import os
 import traceback
 from pathlib import Path
 
+import anyio
+import orjson
 from fastapi import FastAPI, File, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-from config import KNOWLEDGE_PATH, URL_CONTENT_PATH
-from rag_core import query_rag
+from config import KNOWLEDGE_PATH, URL_CONTENT_PATH, API_THREADPOOL_SIZE
+from rag_core import aquery_rag, astream_rag, load_semantic_cache, save_semantic_cache
 from ingest import (
     ingest_pdf,
     ingest_docx,
-    ingest_url,
+    ingest_url_async,
+    new_async_http_client,
     ingest_knowledge_file,
     reingest_all_sources,
     parse_url_content_file,
@@ -32,7 +35,12 @@ from ingest import (
     delete_qna_at_index,
 )
 
-app = FastAPI(title="RAG API", description="Query and ingest into the knowledge base")
+# orjson encodes large /knowledge and /urls payloads much faster than stdlib json and emits bytes directly.
+app = FastAPI(
+    title="RAG API",
+    description="Query and ingest into the knowledge base",
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -43,6 +51,34 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def raise_threadpool_limit():
+    """Let more blocking calls (embeddings, Groq, Chroma) run at once than Starlette's default 40."""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+
+
+@app.on_event("startup")
+async def open_http_client():
+    """One pooled HTTP/2 client for all URL fetches (keep-alive across requests)."""
+    app.state.http = new_async_http_client()
+
+
+@app.on_event("startup")
+async def preload_semantic_cache():
+    """Load the persisted answer cache off the event loop (np.load + JSON of up to QUERY_CACHE_SIZE answers)."""
+    await anyio.to_thread.run_sync(load_semantic_cache)
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await app.state.http.aclose()
+
+
+@app.on_event("shutdown")
+async def persist_semantic_cache():
+    await anyio.to_thread.run_sync(save_semantic_cache)
+
+
 class QueryRequest(BaseModel):
     question: str
 
@@ -72,9 +108,9 @@ def health():
 
 
 @app.post("/query", response_model=QueryResponse)
-def query(request: QueryRequest):
+async def query(request: QueryRequest):
     try:
-        result = query_rag(request.question)
+        result = await aquery_rag(request.question)
         return QueryResponse(answer=result["answer"], sources=result.get("sources", []))
     except ValueError as e:
         traceback.print_exc()
@@ -84,6 +120,31 @@ def query(request: QueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    """
+    NDJSON stream: {"sources": [...]} first, then {"delta": "..."} answer pieces as Groq generates them;
+    a final {"error": "..."} means generation failed and replaces the pieces sent so far.
+    """
+    events = astream_rag(request.question)
+    try:
+        # Errors before the first event (e.g. missing API keys, Chroma failures) are reported like /query's.
+        first = await events.__anext__()
+    except ValueError as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def ndjson():
+        yield orjson.dumps(first) + b"\n"
+        async for event in events:
+            yield orjson.dumps(event) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
 @app.get("/knowledge")
 def get_knowledge():
     """Return the current knowledge base file content."""
@@ -100,7 +161,7 @@ def get_knowledge():
 
 
 @app.put("/knowledge")
-def save_knowledge(body: KnowledgeContent):
+async def save_knowledge(body: KnowledgeContent):
     """Save content to knowledge base file and re-ingest into Chroma (replaces existing KB)."""
     path = Path(KNOWLEDGE_PATH)
     if not path.is_absolute():
@@ -111,19 +172,19 @@ def save_knowledge(body: KnowledgeContent):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
     try:
-        n = reingest_all_sources()
+        n = await anyio.to_thread.run_sync(reingest_all_sources)
         return IngestResponse(ok=True, message="Knowledge base saved and updated.", chunks_added=n)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/ingest/url", response_model=IngestResponse)
-def ingest_url_endpoint(body: IngestUrlRequest):
+async def ingest_url_endpoint(body: IngestUrlRequest):
     url = (body.url or "").strip()
     if not url:
         raise HTTPException(status_code=400, detail="url is required")
     try:
-        n = ingest_url(url)
+        n = await ingest_url_async(url, app.state.http)
         return IngestResponse(ok=True, message=f"Ingested URL: {url}", chunks_added=n)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -133,13 +194,16 @@ def ingest_url_endpoint(body: IngestUrlRequest):
 async def ingest_document_endpoint(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="filename required")
-    content = await file.read()
+    # UploadFile.file is already a SpooledTemporaryFile (RAM up to 1 MB, then disk): parse it in place
+    # rather than buffering the whole upload with `await file.read()`.
+    await file.seek(0)
+    stream = file.file
     suffix = Path(file.filename or "").suffix.lower()
     try:
         if suffix == ".pdf":
-            n = ingest_pdf(content, filename=file.filename)
+            n = await anyio.to_thread.run_sync(lambda: ingest_pdf(stream, filename=file.filename))
         elif suffix == ".docx":
-            n = ingest_docx(content, filename=file.filename)
+            n = await anyio.to_thread.run_sync(lambda: ingest_docx(stream, filename=file.filename))
         else:
             raise HTTPException(status_code=400, detail="Only PDF and DOCX are supported")
         return IngestResponse(ok=True, message=f"Ingested: {file.filename}", chunks_added=n)
@@ -279,7 +343,12 @@ def run():
     import uvicorn
     host = os.environ.get("API_HOST", "0.0.0.0")
     port = int(os.environ.get("PORT") or os.environ.get("API_PORT", "8000"))
-    uvicorn.run(app, host=host, port=port)
+    # One worker by default: each process would open its own Chroma PersistentClient (and in-memory HNSW
+    # index) on CHROMA_PATH, which Chroma doesn't support across processes, and keep its own answer
+    # caches, so other workers can miss new chunks and serve stale answers after an edit. API_WORKERS > 1
+    # is opt-in for read-mostly deployments (see STEPS.md).
+    workers = int(os.environ.get("API_WORKERS") or 1)
+    uvicorn.run("api:app", host=host, port=port, workers=workers)
 
 
 if __name__ == "__main__":
@@ -7,16 +7,61 @@ KNOWLEDGE_PATH = os.environ.get("KNOWLEDGE_PATH", "knowledge.txt")
 URL_CONTENT_PATH = os.environ.get("URL_CONTENT_PATH", "url_content.txt")
 QNA_PATH = os.environ.get("QNA_PATH", "qna.txt")
 DOCUMENTS_DIR = os.environ.get("DOCUMENTS_DIR", "documents")
+# Content digest per source at the last full re-ingest (lives with the Chroma data it describes)
+SOURCES_MANIFEST_PATH = os.environ.get("SOURCES_MANIFEST_PATH", os.path.join(CHROMA_PATH, "sources_manifest.json"))
+
+# Ingestion: "pypdfium2" (default, falls back to pypdf if not installed) or "pypdf"
+PDF_BACKEND = os.environ.get("PDF_BACKEND", "pypdfium2").lower()
 
 # Chunking
 CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "500"))
 CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "50"))
+# Chunks per add_chunks_to_collection call when re-ingesting everything
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "256"))
 
 # Retrieval
 TOP_K = int(os.environ.get("TOP_K", "5"))
+# Minimum cosine similarity of the best chunk; below it the question gets a "no relevant information" answer.
 SIMILARITY_THRESHOLD = float(os.environ.get("SIMILARITY_THRESHOLD", "0.4"))
+# Max estimated tokens (~4 chars each) of retrieved context put into the generation prompt
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "6000"))
+
+# HNSW index parameters, applied when the Chroma collection is created (existing collections keep
+# theirs until rebuilt, e.g. by a forced re-ingest)
+HNSW_SPACE = os.environ.get("HNSW_SPACE", "cosine")
+HNSW_M = int(os.environ.get("HNSW_M", "24"))
+HNSW_CONSTRUCTION_EF = int(os.environ.get("HNSW_CONSTRUCTION_EF", "128"))
+HNSW_SEARCH_EF = int(os.environ.get("HNSW_SEARCH_EF", "100"))
+# Re-pick search_ef from the chunk count when the collection is opened or written (40 / 100 / 200
+# below 100k / 1M / above). While on, HNSW_SEARCH_EF is only the value a new collection starts with;
+# set HNSW_AUTO_SEARCH_EF=0 to keep HNSW_SEARCH_EF. search_ef is collection-wide, not per query.
+HNSW_AUTO_SEARCH_EF = os.environ.get("HNSW_AUTO_SEARCH_EF", "1") not in ("0", "false", "no")
+
+# Answer cache for repeated questions (entries, seconds): exact question match, then
+# semantic match (cosine similarity of question embeddings >= SEMANTIC_CACHE_THRESHOLD)
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_TTL = int(os.environ.get("QUERY_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_PATH = os.environ.get("SEMANTIC_CACHE_PATH", os.path.join(CHROMA_PATH, "semantic_cache.npz"))
+# Token rewritten on every knowledge-base change (any process); a persisted semantic cache saved under
+# another token is stale and is discarded on load.
+KB_VERSION_PATH = os.environ.get("KB_VERSION_PATH", os.path.join(CHROMA_PATH, "kb_version"))
+
+# API
+API_THREADPOOL_SIZE = int(os.environ.get("API_THREADPOOL_SIZE", "200"))
+
+# Embedding requests: items / estimated tokens per batch call, batch calls in flight
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "96"))
+EMBED_BATCH_TOKENS = int(os.environ.get("EMBED_BATCH_TOKENS", "20000"))
+MAX_EMBED_CONCURRENCY = int(os.environ.get("MAX_EMBED_CONCURRENCY", "8"))
+# On-disk embedding cache directory (requires diskcache; empty string disables)
+EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", os.path.join(os.path.dirname(__file__), ".embed_cache"))
 
 # Models
 EMBEDDING_MODEL = "models/gemini-embedding-001"
+# Truncated (Matryoshka) embedding size: 768 of the model's 3072 dims is 4x less memory per vector and per
+# HNSW hop at a small recall cost; 0 = full size. A collection built with another size is refused until
+# re-ingested (see "Upgrading" in STEPS.md; set 0 to keep a collection built before this setting).
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", "768"))
 GENERATION_MODEL = "llama-3.3-70b-versatile"
 CHROMA_COLLECTION_NAME = "rag_chunks"
@@ -1,76 +1,286 @@
 """
 Ingest PDF, DOCX, and URL into the RAG knowledge base (Chroma).
 """
+import codecs
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
 import re
-import uuid
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from io import BytesIO
+from itertools import islice
 from pathlib import Path
+from typing import Iterable, Iterator
 
+import anyio
+import httpx
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    INGEST_BATCH_SIZE,
+    KNOWLEDGE_PATH,
+    URL_CONTENT_PATH,
+    QNA_PATH,
+    DOCUMENTS_DIR,
+    PDF_BACKEND,
+    SOURCES_MANIFEST_PATH,
+    EMBEDDING_DIMENSIONS,
+)
+from rag_core import (
+    chunk_text,
+    chunk_id,
+    iter_chunks,
+    add_chunks_to_collection,
+    delete_chunks_by_source,
+    delete_stale_chunks,
+    replace_source_chunks,
+)
 
-from config import CHUNK_SIZE, CHUNK_OVERLAP, KNOWLEDGE_PATH, URL_CONTENT_PATH, QNA_PATH, DOCUMENTS_DIR
-from rag_core import chunk_text, add_chunks_to_collection, delete_chunks_by_source
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # Optional deps for PDF/DOCX
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
 try:
     import pypdf
 except ImportError:
     pypdf = None
+# C-based XML/HTML parsing when lxml is available (DOCX XML streaming, BeautifulSoup backend)
 try:
-    from docx import Document as DocxDocument
+    from lxml import etree as _xml_etree
+    _HTML_PARSER = "lxml"
 except ImportError:
-    DocxDocument = None
+    import xml.etree.ElementTree as _xml_etree
+    _HTML_PARSER = "html.parser"
+
+
+_WS_RE = re.compile(r"\s+")
 
 
 def _clean_text(text: str) -> str:
+    """Collapse whitespace runs to one space. Call once on a whole extracted document, not per page."""
     if not text:
         return ""
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
+    return _WS_RE.sub(" ", text).strip()
 
 
-def extract_text_pdf(path_or_bytes) -> str:
-    """Extract text from a PDF file path or bytes."""
-    if pypdf is None:
-        raise ImportError("Install pypdf: pip install pypdf")
+def _as_source(path_or_bytes):
+    """Path -> str, raw bytes -> BytesIO; binary file objects are passed through unchanged."""
     if isinstance(path_or_bytes, (str, Path)):
-        reader = pypdf.PdfReader(str(path_or_bytes))
-    else:
-        from io import BytesIO
-        reader = pypdf.PdfReader(BytesIO(path_or_bytes))
-    parts = []
-    for page in reader.pages:
-        t = page.extract_text()
-        if t:
-            parts.append(t)
-    return _clean_text("\n".join(parts))
+        return str(path_or_bytes)
+    if isinstance(path_or_bytes, (bytes, bytearray, memoryview)):
+        return BytesIO(path_or_bytes)
+    return path_or_bytes
+
+
+# PDFs with more pages than this are split across a process pool (page text extraction is CPU-bound).
+_PARALLEL_PDF_MIN_PAGES = 3
+_pdf_pool: ProcessPoolExecutor | None = None
+_pdf_pool_lock = threading.Lock()
+# pdfium is not thread-safe; serialize its use within a process (pool workers are separate processes).
+_pdfium_lock = threading.Lock()
+
+
+def _use_pdfium() -> bool:
+    """pypdfium2 (C backend) by default; PDF_BACKEND=pypdf or a missing pypdfium2 falls back to pypdf."""
+    if pdfium is not None and PDF_BACKEND != "pypdf":
+        return True
+    if pypdf is None:
+        raise ImportError("Install pypdfium2 or pypdf: pip install pypdfium2")
+    return False
+
+
+def _open_pdf(src):
+    """Open a PDF with the configured backend. Returns (document, page_count)."""
+    if _use_pdfium():
+        pdf = pdfium.PdfDocument(src)
+        return pdf, len(pdf)
+    reader = pypdf.PdfReader(src)
+    return reader, len(reader.pages)
+
+
+def _pdf_page_texts(pdf, start: int, stop: int) -> list[str]:
+    if pdfium is not None and isinstance(pdf, pdfium.PdfDocument):
+        out = []
+        for i in range(start, stop):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            out.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return out
+    return [pdf.pages[i].extract_text() for i in range(start, stop)]
+
+
+def _close_pdf(pdf) -> None:
+    if pdfium is not None and isinstance(pdf, pdfium.PdfDocument):
+        pdf.close()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn, not fork: the API process has live threads (uvicorn, anyio pool) when this is first used.
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pdf_pool
+
+
+def _extract_pdf_pages(src, start: int, stop: int) -> list[str]:
+    """Process-pool worker: extract text of pages [start, stop) from a PDF path or bytes."""
+    pdf, _ = _open_pdf(_as_source(src))
+    try:
+        return _pdf_page_texts(pdf, start, stop)
+    finally:
+        _close_pdf(pdf)
+
+
+def extract_text_pdf(path_or_bytes) -> str:
+    """Extract text from a PDF file path, bytes, or binary file object."""
+    lock = _pdfium_lock if _use_pdfium() else nullcontext()
+    with lock:
+        pdf, n_pages = _open_pdf(_as_source(path_or_bytes))
+        try:
+            workers = min(os.cpu_count() or 1, n_pages)
+            parallel = n_pages > _PARALLEL_PDF_MIN_PAGES and workers >= 2
+            parts = [] if parallel else _pdf_page_texts(pdf, 0, n_pages)
+        finally:
+            _close_pdf(pdf)
+    if parallel:
+        # Workers reopen the PDF themselves (documents aren't picklable): send a path or the raw bytes.
+        if isinstance(path_or_bytes, (str, Path)):
+            src = str(path_or_bytes)
+        elif isinstance(path_or_bytes, (bytes, bytearray, memoryview)):
+            src = bytes(path_or_bytes)
+        else:
+            path_or_bytes.seek(0)
+            src = path_or_bytes.read()
+        step = -(-n_pages // workers)
+        futures = [
+            _get_pdf_pool().submit(_extract_pdf_pages, src, start, min(start + step, n_pages))
+            for start in range(0, n_pages, step)
+        ]
+        parts = [t for f in futures for t in f.result()]
+    return _clean_text("\n".join(t for t in parts if t))
+
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_T, _W_P = _W_NS + "t", _W_NS + "p"
+_W_BREAKS = {_W_NS + "tab", _W_NS + "br", _W_NS + "cr"}
 
 
 def extract_text_docx(path_or_bytes) -> str:
-    """Extract text from a DOCX file path or bytes."""
-    if DocxDocument is None:
-        raise ImportError("Install python-docx: pip install python-docx")
-    if isinstance(path_or_bytes, (str, Path)):
-        doc = DocxDocument(str(path_or_bytes))
-    else:
-        from io import BytesIO
-        doc = DocxDocument(BytesIO(path_or_bytes))
-    parts = [p.text for p in doc.paragraphs if p.text.strip()]
-    return _clean_text("\n".join(parts))
+    """
+    Extract text from a DOCX file path, bytes, or binary file object.
+    Streams word/document.xml with iterparse and collects <w:t> runs directly (no python-docx DOM).
+    """
+    parts = []
+    with zipfile.ZipFile(_as_source(path_or_bytes)) as z, z.open("word/document.xml") as xml:
+        for _, el in _xml_etree.iterparse(xml, events=("end",)):
+            tag = el.tag
+            if tag == _W_T:
+                if el.text:
+                    parts.append(el.text)
+            elif tag in _W_BREAKS:
+                parts.append(" ")
+            elif tag == _W_P:
+                parts.append("\n")
+                el.clear()
+    return _clean_text("".join(parts))
 
 
-def extract_text_url(url: str, timeout: int = 15) -> str:
-    """Fetch URL and extract main text (strip script/style, get body text)."""
-    headers = {"User-Agent": "RAGBot/1.0 (Knowledge base ingestion)"}
-    resp = requests.get(url, timeout=timeout, headers=headers)
-    resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, "html.parser")
+_HTTP_HEADERS = {"User-Agent": "RAGBot/1.0 (Knowledge base ingestion)"}
+
+
+# <script>/<style> elements are dropped from the raw bytes so the parser never builds trees for them.
+_SCRIPT_STYLE_RE = re.compile(rb"<(script|style)\b[^>]*>.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+
+
+def _html_to_text(html: bytes) -> str:
+    """Extract main text from raw HTML bytes (strip script/style/nav/footer/header)."""
+    soup = BeautifulSoup(_SCRIPT_STYLE_RE.sub(b"", html), _HTML_PARSER)
     for tag in soup(["script", "style", "nav", "footer", "header"]):
         tag.decompose()
     text = soup.get_text(separator="\n")
     return _clean_text(text)
 
 
+def _new_http_session() -> requests.Session:
+    """Keep-alive session for sync URL fetches: pooled connections (no TCP+TLS handshake per URL), two retries."""
+    session = requests.Session()
+    session.headers.update(_HTTP_HEADERS)
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.3))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_SESSION = _new_http_session()
+
+
+def extract_text_url(url: str, timeout: int = 15) -> str:
+    """Fetch URL and extract main text (strip script/style, get body text)."""
+    resp = _SESSION.get(url, timeout=timeout)
+    resp.raise_for_status()
+    return _html_to_text(resp.content)
+
+
+def new_async_http_client(timeout: float = 15) -> httpx.AsyncClient:
+    """Shared async client (HTTP/2, keep-alive pool) for URL fetches; close with aclose()."""
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        timeout=timeout,
+        headers=_HTTP_HEADERS,
+        follow_redirects=True,
+    )
+
+
+async def extract_text_url_async(url: str, client: httpx.AsyncClient) -> str:
+    """Async variant of extract_text_url using a shared httpx client."""
+    resp = await client.get(url)
+    resp.raise_for_status()
+    return await anyio.to_thread.run_sync(_html_to_text, resp.content)
+
+
+def _prepare_chunks(
+    text: str,
+    source_label: str,
+    metadata_base: dict | None = None,
+) -> tuple[list[str], list[dict]]:
+    """Chunk text and build (chunks, metadatas) for add_chunks_to_collection."""
+    if not text or not text.strip():
+        return [], []
+    chunks = chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+    if not chunks:
+        return [], []
+    return chunks, _chunk_metadatas(chunks, source_label, metadata_base)
+
+
+def _chunk_metadatas(chunks: list[str], source_label: str, metadata_base: dict | None) -> list[dict]:
+    """Per-chunk metadatas for an already-chunked source (ids are derived from source + text in rag_core)."""
+    base_with_src = {**(metadata_base or {}), "source": source_label}
+    return [base_with_src.copy() for _ in chunks]
+
+
 def ingest_text(
     text: str,
     source_label: str,
@@ -80,18 +290,66 @@ def ingest_text(
     Chunk text and add to Chroma. source_label is used in 'source' metadata.
     Returns number of chunks added.
     """
-    if not text or not text.strip():
-        return 0
-    chunks = chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
-    if not chunks:
-        return 0
-    base = metadata_base or {}
-    metadatas = [{**base, "source": source_label} for _ in chunks]
-    ids = [str(uuid.uuid4()) for _ in chunks]
-    add_chunks_to_collection(chunks, metadatas=metadatas, ids=ids)
+    chunks, metadatas = _prepare_chunks(text, source_label, metadata_base)
+    if chunks:
+        add_chunks_to_collection(chunks, metadatas=metadatas)
     return len(chunks)
 
 
+def replace_source_text(
+    text: str,
+    source_label: str,
+    metadata_base: dict | None = None,
+) -> int:
+    """
+    Make text the whole content of source_label in Chroma: upsert its chunks, then drop the
+    source's chunks that are gone (no delete-everything-then-add). Returns number of chunks.
+    """
+    chunks, metadatas = _prepare_chunks(text, source_label, metadata_base)
+    return replace_source_chunks(source_label, chunks, metadatas)
+
+
+class _ChunkBatch:
+    """
+    Accumulate chunks from many sources and add them to Chroma in INGEST_BATCH_SIZE batches.
+    ids_by_source records every chunk id added per source (for delete_stale_chunks afterwards).
+    """
+
+    def __init__(self, batch_size: int = INGEST_BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.chunks: list[str] = []
+        self.metadatas: list[dict] = []
+        self.ids: list[str] = []
+        self.ids_by_source: dict[str, set[str]] = {}
+        self.total = 0
+
+    def add_text(self, text: str, source_label: str, metadata_base: dict | None = None) -> None:
+        self.add_chunks(chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP), source_label, metadata_base)
+
+    def add_chunks(self, chunks: Iterable[str], source_label: str, metadata_base: dict | None = None) -> None:
+        """Add chunks (list or lazy iterator); full batches are flushed as they fill up."""
+        it = iter(chunks)
+        while piece := list(islice(it, self.batch_size)):
+            ids = [chunk_id(source_label, c) for c in piece]
+            self.chunks.extend(piece)
+            self.metadatas.extend(_chunk_metadatas(piece, source_label, metadata_base))
+            self.ids.extend(ids)
+            self.ids_by_source.setdefault(source_label, set()).update(ids)
+            self.total += len(piece)
+            while len(self.chunks) >= self.batch_size:
+                self._flush(self.batch_size)
+
+    def flush(self) -> int:
+        """Add any remaining chunks. Returns total chunks added through this batch."""
+        if self.chunks:
+            self._flush(len(self.chunks))
+        return self.total
+
+    def _flush(self, n: int) -> None:
+        add_chunks_to_collection(self.chunks[:n], metadatas=self.metadatas[:n], ids=self.ids[:n])
+        del self.chunks[:n], self.metadatas[:n], self.ids[:n]
+
+
 def ingest_pdf(path_or_bytes, filename: str | None = None) -> int:
     """Ingest a PDF. filename used as source label (e.g. 'policy.pdf')."""
     text = extract_text_pdf(path_or_bytes)
@@ -110,33 +368,96 @@ def ingest_docx(path_or_bytes, filename: str | None = None) -> int:
     return ingest_text(text, source_label=label, metadata_base={"type": "docx"})
 
 
+# Long-lived O_APPEND descriptors for url_content.txt / qna.txt, keyed by path.
+_append_fds: dict[str, int] = {}
+_append_lock = threading.Lock()
+
+
+@contextmanager
+def _locked_fd(path: Path) -> Iterator[int]:
+    """
+    Cached O_APPEND fd for path, held under a thread lock plus an exclusive flock so appends and
+    rewrites from several API worker processes never interleave (flock is skipped where fcntl is unavailable).
+    """
+    key = str(path)
+    with _append_lock:
+        fd = _append_fds.get(key)
+        if fd is not None and os.fstat(fd).st_nlink == 0:
+            # File was deleted behind our back: drop the stale descriptor and recreate it.
+            os.close(fd)
+            fd = None
+        if fd is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(key, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _append_fds[key] = fd
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield fd
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _append_to_file(path: Path, text: str) -> None:
+    """Append text with a single write() on the cached O_APPEND fd (appends are atomic on POSIX)."""
+    data = memoryview(text.encode("utf-8"))
+    with _locked_fd(path) as fd:
+        while data:
+            data = data[os.write(fd, data):]
+
+
 def _append_url_content_to_file(url: str, text: str) -> None:
     """Append extracted URL text to url_content.txt for persistent storage and RAG training."""
-    path = Path(URL_CONTENT_PATH)
-    if not path.is_absolute():
-        path = Path(__file__).resolve().parent / path
-    path.parent.mkdir(parents=True, exist_ok=True)
-    separator = "\n\n--- URL: {} ---\n\n".format(url)
-    with path.open("a", encoding="utf-8") as f:
-        f.write(separator)
-        f.write(text)
-        f.write("\n")
+    _append_to_file(_url_content_path(), "\n\n--- URL: {} ---\n\n{}\n".format(url, text))
 
 
-def ingest_url(url: str) -> int:
-    """Fetch URL, extract text, save to url_content.txt, and ingest into Chroma."""
-    text = extract_text_url(url)
+def _store_url_text(url: str, text: str) -> int:
+    """Save extracted URL text to url_content.txt and ingest into Chroma."""
     _append_url_content_to_file(url, text)
     return ingest_text(text, source_label=url, metadata_base={"type": "url", "url": url})
 
 
+def ingest_url(url: str) -> int:
+    """Fetch URL, extract text, save to url_content.txt, and ingest into Chroma."""
+    return _store_url_text(url, extract_text_url(url))
+
+
+async def ingest_url_async(url: str, client: httpx.AsyncClient) -> int:
+    """Like ingest_url, but fetches with the shared async client; storage/embedding run in a worker thread."""
+    text = await extract_text_url_async(url, client)
+    return await anyio.to_thread.run_sync(_store_url_text, url, text)
+
+
 def ingest_knowledge_file(path: str | None = None) -> int:
     """Ingest a plain-text knowledge file (e.g. knowledge.txt)."""
     path = Path(path or KNOWLEDGE_PATH)
     if not path.exists():
         raise FileNotFoundError(str(path))
-    text = path.read_text(encoding="utf-8", errors="replace")
-    return ingest_text(text, source_label=path.name, metadata_base={"type": "txt"})
+    batch = _ChunkBatch()
+    batch.add_chunks(iter_chunks(_iter_file_text(path)), source_label=path.name, metadata_base={"type": "txt"})
+    return batch.flush()
+
+
+# Bytes decoded per step when streaming a text file
+_READ_WINDOW = 1 << 20
+
+
+def _iter_file_text(path: Path, window: int = _READ_WINDOW) -> Iterator[str]:
+    """
+    Yield a UTF-8 text file as decoded windows of plain reads, so the whole file is never one str.
+    (Not mmap: PUT /knowledge truncates the file in place, and touching mmap pages past the new end
+    raises SIGBUS, killing the worker; a read just returns less.)
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(window), b""):
+            text = decoder.decode(block)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
 
 
 def _url_content_path() -> Path:
@@ -146,33 +467,50 @@ def _url_content_path() -> Path:
     return p
 
 
+def _file_key(path: Path) -> tuple[str, int, int] | None:
+    """(path, mtime_ns, size) for parse caches, or None if the file doesn't exist."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return str(path), st.st_mtime_ns, st.st_size
+
+
 def parse_url_content_file() -> list[dict]:
-    """Return list of {url, content} from url_content.txt."""
-    path = _url_content_path()
-    if not path.exists():
+    """Return list of {url, content} from url_content.txt (re-parsed only when the file changes)."""
+    key = _file_key(_url_content_path())
+    if key is None:
         return []
-    text = path.read_text(encoding="utf-8", errors="replace")
-    entries = []
-    for block in text.split("--- URL:"):
-        block = block.strip()
-        if not block:
-            continue
-        first_newline = block.find("\n")
-        if first_newline >= 0:
-            url = block[:first_newline].strip()
-            content = block[first_newline:].strip()
-        else:
-            url = block
-            content = ""
-        if url:
-            entries.append({"url": url, "content": content})
-    return entries
+    return [dict(e) for e in _parse_url_content_cached(*key)]
+
+
+# One "--- URL: <url> ---" header line plus everything up to the next header (or EOF).
+# Tolerates repeated " ---" suffixes left by older rewrites of the file.
+_URL_BLOCK_RE = re.compile(
+    r"^--- URL: (?P<url>[^\n]*?)(?: ---)*[ \t]*$(?P<content>.*?)(?=^--- URL: |\Z)",
+    re.DOTALL | re.MULTILINE,
+)
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_url_content_cached(path: str, mtime_ns: int, size: int) -> tuple[dict, ...]:
+    text = Path(path).read_text(encoding="utf-8", errors="replace")
+    return tuple(
+        {"url": m["url"].strip(), "content": m["content"].strip()}
+        for m in _URL_BLOCK_RE.finditer(text)
+        if m["url"].strip()
+    )
 
 
 def rewrite_url_content_file(entries: list[dict]) -> None:
     """Write url_content.txt with given list of {url, content} (used after removing one URL)."""
     path = _url_content_path()
-    path.parent.mkdir(parents=True, exist_ok=True)
+    with _locked_fd(path):
+        _write_url_content_file(path, entries)
+
+
+def _write_url_content_file(path: Path, entries: list[dict]) -> None:
+    """rewrite_url_content_file body; caller holds _locked_fd(path)."""
     parts = []
     for e in entries:
         parts.append("--- URL: {} ---\n\n{}".format(e["url"], e.get("content", "")))
@@ -182,23 +520,25 @@ def rewrite_url_content_file(entries: list[dict]) -> None:
 def remove_url_from_knowledge_base(url: str) -> None:
     """Remove URL's chunks from Chroma and remove from url_content.txt."""
     delete_chunks_by_source(url)
-    entries = [e for e in parse_url_content_file() if e["url"] != url]
-    rewrite_url_content_file(entries)
+    path = _url_content_path()
+    # Parse and rewrite under one lock so a concurrent append or edit isn't lost in between.
+    with _locked_fd(path):
+        _write_url_content_file(path, [e for e in parse_url_content_file() if e["url"] != url])
 
 
 def update_url_content(url: str, new_content: str) -> None:
-    """Replace URL's stored content and re-ingest (delete old chunks, add new)."""
-    delete_chunks_by_source(url)
-    entries = parse_url_content_file()
-    for e in entries:
-        if e["url"] == url:
-            e["content"] = new_content
-            break
-    else:
-        entries.append({"url": url, "content": new_content})
-    rewrite_url_content_file(entries)
-    if new_content.strip():
-        ingest_text(new_content, source_label=url, metadata_base={"type": "url", "url": url})
+    """Replace URL's stored content and re-ingest (upsert new chunks, drop ones no longer present)."""
+    path = _url_content_path()
+    with _locked_fd(path):
+        entries = parse_url_content_file()
+        for e in entries:
+            if e["url"] == url:
+                e["content"] = new_content
+                break
+        else:
+            entries.append({"url": url, "content": new_content})
+        _write_url_content_file(path, entries)
+    replace_source_text(new_content, source_label=url, metadata_base={"type": "url", "url": url})
 
 
 def _documents_path() -> Path:
@@ -236,10 +576,7 @@ def save_document(doc_id: str, name: str, content: str) -> int:
     base.mkdir(parents=True, exist_ok=True)
     f = base / (doc_id + ".txt")
     f.write_text(content, encoding="utf-8")
-    delete_chunks_by_source(doc_id)
-    if content.strip():
-        return ingest_text(content, source_label=doc_id, metadata_base={"type": "doc", "name": name})
-    return 0
+    return replace_source_text(content, source_label=doc_id, metadata_base={"type": "doc", "name": name})
 
 
 def delete_document(doc_id: str) -> None:
@@ -259,11 +596,16 @@ def _qna_path() -> Path:
 
 
 def parse_qna_file() -> list[dict]:
-    """Return list of {question, answer} from qna.txt. Format: Q: ... A: ..."""
-    path = _qna_path()
-    if not path.exists():
+    """Return list of {question, answer} from qna.txt. Format: Q: ... A: ... (re-parsed only when the file changes)."""
+    key = _file_key(_qna_path())
+    if key is None:
         return []
-    text = path.read_text(encoding="utf-8", errors="replace")
+    return [dict(e) for e in _parse_qna_cached(*key)]
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_qna_cached(path: str, mtime_ns: int, size: int) -> tuple[dict, ...]:
+    text = Path(path).read_text(encoding="utf-8", errors="replace")
     entries = []
     for block in text.split("\n\n"):
         block = block.strip()
@@ -280,16 +622,12 @@ def parse_qna_file() -> list[dict]:
             else:
                 q = block[2:].strip()
         entries.append({"question": q, "answer": a})
-    return entries
+    return tuple(entries)
 
 
 def append_qna(question: str, answer: str) -> int:
     """Append Q&A to qna.txt and ingest as text 'Q: ... A: ...'."""
-    path = _qna_path()
-    path.parent.mkdir(parents=True, exist_ok=True)
-    line = "Q: {}\nA: {}\n\n".format(question.strip(), answer.strip())
-    with path.open("a", encoding="utf-8") as f:
-        f.write(line)
+    _append_to_file(_qna_path(), "Q: {}\nA: {}\n\n".format(question.strip(), answer.strip()))
     text = "Q: {}\nA: {}".format(question.strip(), answer.strip())
     return ingest_text(text, source_label="qna", metadata_base={"type": "qna"})
 
@@ -299,50 +637,132 @@ def delete_all_qna() -> None:
     delete_chunks_by_source("qna")
     path = _qna_path()
     if path.exists():
-        path.write_text("", encoding="utf-8")
+        with _locked_fd(path):
+            path.write_text("", encoding="utf-8")
 
 
 def _write_qna_file(entries: list[dict]) -> None:
-    """Write qna.txt from list of {question, answer}."""
-    path = _qna_path()
-    path.parent.mkdir(parents=True, exist_ok=True)
+    """Write qna.txt from list of {question, answer}; caller holds _locked_fd(_qna_path())."""
     lines = ["Q: {}\nA: {}".format(e.get("question", "").strip(), e.get("answer", "").strip()) for e in entries]
-    path.write_text("\n\n".join(lines) + ("\n\n" if lines else ""), encoding="utf-8")
+    _qna_path().write_text("\n\n".join(lines) + ("\n\n" if lines else ""), encoding="utf-8")
 
 
 def delete_qna_at_index(index: int) -> None:
     """Remove the Q&A pair at index (0-based), rewrite qna.txt, and re-ingest remaining Q&A."""
-    entries = parse_qna_file()
-    if index < 0 or index >= len(entries):
-        raise IndexError("Q&A index out of range")
-    entries.pop(index)
-    _write_qna_file(entries)
-    delete_chunks_by_source("qna")
-    if entries:
-        text = "\n\n".join("Q: {}\nA: {}".format(e.get("question", ""), e.get("answer", "")) for e in entries)
-        ingest_text(text, source_label="qna", metadata_base={"type": "qna"})
+    # Parse and rewrite under one lock so a concurrent append isn't lost in between.
+    with _locked_fd(_qna_path()):
+        entries = parse_qna_file()
+        if index < 0 or index >= len(entries):
+            raise IndexError("Q&A index out of range")
+        entries.pop(index)
+        _write_qna_file(entries)
+    text = "\n\n".join("Q: {}\nA: {}".format(e.get("question", ""), e.get("answer", "")) for e in entries)
+    replace_source_text(text, source_label="qna", metadata_base={"type": "qna"})
+
+
+def _text_digest(*texts: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for t in texts:
+        h.update(t.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(_READ_WINDOW), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_manifest() -> dict[str, str] | None:
+    """source label -> content digest as of the last reingest_all_sources (None if never run or unreadable)."""
+    try:
+        return json.loads(Path(SOURCES_MANIFEST_PATH).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save_manifest(manifest: dict[str, str]) -> None:
+    path = Path(SOURCES_MANIFEST_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+# Concurrent file reads when loading all documents (read() releases the GIL)
+_READ_WORKERS = 16
+
 
+def _read_documents(doc_ids: list[str]) -> list[str]:
+    """get_document_content for many ids, overlapping the file reads on a small thread pool."""
+    if len(doc_ids) < 2:
+        return [get_document_content(d) for d in doc_ids]
+    with ThreadPoolExecutor(max_workers=min(_READ_WORKERS, len(doc_ids))) as pool:
+        return list(pool.map(get_document_content, doc_ids))
+
+
+def reingest_all_sources(force: bool = False) -> int:
+    """
+    Sync Chroma with knowledge.txt, all URLs, qna.txt, and all documents. Returns chunks added.
+    Only sources whose content changed since the last run (per sources_manifest.json) are
+    deleted and re-ingested; sources that disappeared are deleted. force=True (also used when
+    there is no manifest yet, Chroma is empty, or it holds vectors of another EMBEDDING_DIMENSIONS)
+    clears Chroma and re-ingests everything.
+    """
+    from rag_core import clear_collection, collection_dimensions, with_collection
+    manifest = None if force else _load_manifest()
+    count, dims = with_collection(lambda coll: (coll.count(), collection_dimensions(coll)), check_dimensions=False)
+    force = manifest is None or (bool(manifest) and count == 0) or dims != EMBEDDING_DIMENSIONS
+    if force:
+        clear_collection()
+        # Forget the old manifest before re-adding anything: if a flush fails partway, the next run
+        # must not skip sources as "unchanged" that never made it back into the new collection.
+        _save_manifest({})
+        manifest = {}
+    batch = _ChunkBatch()
+    current: dict[str, str] = {}
+
+    replaced: list[str] = []
+
+    def changed(label: str, digest: str) -> bool:
+        """Record the source; True if its content changed (its stale chunks are dropped after the upserts)."""
+        current[label] = digest
+        if manifest.get(label) == digest:
+            return False
+        if not force:
+            replaced.append(label)
+        return True
 
-def reingest_all_sources() -> int:
-    """Clear Chroma and ingest knowledge.txt, all URLs, qna.txt, and all documents. Returns total chunks."""
-    from rag_core import clear_collection
-    clear_collection()
-    n = 0
     path_k = Path(KNOWLEDGE_PATH)
     if not path_k.is_absolute():
         path_k = Path(__file__).resolve().parent / path_k
-    if path_k.exists():
-        n += ingest_knowledge_file(str(path_k))
+    if path_k.exists() and changed(path_k.name, _file_digest(path_k)):
+        batch.add_chunks(iter_chunks(_iter_file_text(path_k)), source_label=path_k.name, metadata_base={"type": "txt"})
+    # The same URL can be stored more than once (ingested twice); its chunks share one source label.
+    url_contents: dict[str, list[str]] = {}
     for e in parse_url_content_file():
         if e.get("content"):
-            n += ingest_text(e["content"], source_label=e["url"], metadata_base={"type": "url", "url": e["url"]})
+            url_contents.setdefault(e["url"], []).append(e["content"])
+    for url, contents in url_contents.items():
+        if changed(url, _text_digest(*contents)):
+            for content in contents:
+                batch.add_text(content, source_label=url, metadata_base={"type": "url", "url": url})
     path_q = _qna_path()
     if path_q.exists():
         text = path_q.read_text(encoding="utf-8", errors="replace")
-        if text.strip():
-            n += ingest_text(text, source_label="qna", metadata_base={"type": "qna"})
-    for doc in list_documents():
-        content = get_document_content(doc["id"])
-        if content.strip():
-            n += ingest_text(content, source_label=doc["id"], metadata_base={"type": "doc", "name": doc["name"]})
+        if text.strip() and changed("qna", _text_digest(text)):
+            batch.add_text(text, source_label="qna", metadata_base={"type": "qna"})
+    docs = list_documents()
+    for doc, content in zip(docs, _read_documents([d["id"] for d in docs])):
+        if content.strip() and changed(doc["id"], _text_digest(doc["name"], content)):
+            batch.add_text(content, source_label=doc["id"], metadata_base={"type": "doc", "name": doc["name"]})
+    for label in manifest.keys() - current.keys():
+        delete_chunks_by_source(label)
+    n = batch.flush()
+    for label in replaced:
+        delete_stale_chunks(label, batch.ids_by_source.get(label, set()))
+    _save_manifest(current)
     return n
@@ -4,15 +4,14 @@ If the knowledge base is empty, run ingestion first (see STEPS.md).
 """
 import sys
 
-from rag_core import configure_gemini, get_groq_client, get_collection, query_rag
+from rag_core import configure_gemini, get_groq_client, query_rag, with_collection
 
 
 def main() -> None:
     try:
         configure_gemini()
         get_groq_client()
-        coll = get_collection()
-        n = coll.count()
+        n = with_collection(lambda coll: coll.count())
     except ValueError as e:
         print(e, file=sys.stderr)
         sys.exit(1)
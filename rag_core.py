@@ -1,86 +1,415 @@
 """
 RAG core: chunking, Gemini embeddings, Chroma vector store, Groq generation.
 """
+import asyncio
+import functools
+import hashlib
+import json
 import os
+import random
+import threading
+import time
 import warnings
-from typing import Any
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, TypeVar
+
+import anyio
+import numpy as np
+from cachetools import TTLCache
 
 warnings.filterwarnings("ignore", message=".*google.generativeai.*", category=FutureWarning)
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import chromadb
 from chromadb.config import Settings
-from groq import Groq
+from chromadb.errors import NotFoundError
+from groq import AsyncGroq, Groq
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
 
 from config import (
     CHROMA_PATH,
     CHROMA_COLLECTION_NAME,
-    CHUNK_SIZE,
-    CHUNK_OVERLAP,
     TOP_K,
     SIMILARITY_THRESHOLD,
+    PROMPT_TOKEN_BUDGET,
+    HNSW_SPACE,
+    HNSW_M,
+    HNSW_CONSTRUCTION_EF,
+    HNSW_SEARCH_EF,
+    HNSW_AUTO_SEARCH_EF,
     EMBEDDING_MODEL,
+    EMBEDDING_DIMENSIONS,
+    EMBED_CACHE_PATH,
+    EMBED_BATCH_SIZE,
+    EMBED_BATCH_TOKENS,
+    MAX_EMBED_CONCURRENCY,
     GENERATION_MODEL,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_PATH,
+    KB_VERSION_PATH,
 )
-
-_gemini_configured = False
-_groq_client: Groq | None = None
-
-
+# Re-exported: ingest and other callers import the chunkers from here.
+from rag_core_hot import chunk_text, iter_chunks, sanitize_metadatas
+
+# Content-addressed embedding cache (sha256 of model + text -> vector); shared by all worker processes.
+_embed_cache = diskcache.Cache(EMBED_CACHE_PATH) if diskcache is not None and EMBED_CACHE_PATH else None
+_async_groq_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncGroq]" = weakref.WeakKeyDictionary()
+# Opened once per process: PersistentClient and get_or_create_collection are too costly for every add/query.
+_CHROMA_SETTINGS = Settings(anonymized_telemetry=False)
+_chroma_client = None
+_collection = None
+_collection_lock = threading.Lock()
+
+# Answers for repeated questions; both tiers are cleared whenever the collection changes.
+# Exact tier: normalized question hash -> result.
+QUERY_CACHE: TTLCache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+QUERY_CACHE_LOCK = threading.Lock()
+# Bumped (under QUERY_CACHE_LOCK) by every clear; an answer generated across a bump is not cached.
+_cache_generation = 0
+# Semantic tier: SEMANTIC_CACHE (below), also guarded by QUERY_CACHE_LOCK; persisted on shutdown.
+
+
+# Memoized: every later call is one C-level cache lookup. A call that raises (missing key) isn't cached.
+@functools.cache
 def configure_gemini() -> None:
-    global _gemini_configured
-    if _gemini_configured:
-        return
     key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
     if not key:
         raise ValueError("Set GEMINI_API_KEY or GOOGLE_API_KEY")
     genai.configure(api_key=key)
-    _gemini_configured = True
 
 
+@functools.lru_cache(maxsize=1)
 def get_groq_client() -> Groq:
-    global _groq_client
-    if _groq_client is None:
+    key = os.environ.get("GROQ_API_KEY")
+    if not key:
+        raise ValueError("Set GROQ_API_KEY")
+    return Groq(api_key=key)
+
+
+def get_async_groq_client() -> AsyncGroq:
+    """AsyncGroq client for the running event loop (its connection pool can't be shared across loops)."""
+    loop = asyncio.get_running_loop()
+    client = _async_groq_clients.get(loop)
+    if client is None:
         key = os.environ.get("GROQ_API_KEY")
         if not key:
             raise ValueError("Set GROQ_API_KEY")
-        _groq_client = Groq(api_key=key)
-    return _groq_client
+        client = _async_groq_clients[loop] = AsyncGroq(api_key=key)
+    return client
 
 
-def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list[str]:
-    """Split text into chunks with optional overlap. Prefer word boundaries."""
-    text = (text or "").strip()
-    if not text:
-        return []
-    words = text.split()
-    if not words:
-        return []
-    chunks = []
-    step = max(1, chunk_size - overlap)
-    for i in range(0, len(words), step):
-        chunk = " ".join(words[i : i + chunk_size])
-        if chunk.strip():
-            chunks.append(chunk)
-        if i + chunk_size >= len(words):
-            break
-    return chunks
+def query_cache_key(question: str) -> bytes:
+    """Exact-tier cache key: sha256 of the stripped, lower-cased question and the generation model."""
+    normalized = (question or "").strip().lower()
+    return hashlib.sha256(f"{normalized}|{GENERATION_MODEL}".encode("utf-8")).digest()
+
+
+class SemanticCache:
+    """
+    Semantic answer tier: unit question embeddings as rows of one float32 matrix, matched against a new
+    question with a single matmul. Rows grow in blocks of BLOCK; past max_entries the oldest row is
+    overwritten. Saved as one float16 .npz (half the size) tagged with the knowledge-base version the
+    answers were built against, and loaded lazily on first use only if that version is still current.
+    Not locked itself; callers hold QUERY_CACHE_LOCK.
+    """
+
+    BLOCK = 4096
+
+    def __init__(self, path: str, threshold: float, max_entries: int, ttl: float):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.E: np.ndarray | None = None  # (capacity, dim); rows [0, n) are live
+        self.entries: list[tuple[float, dict[str, Any]]] = []  # (stored_at, result) per row
+        self.n = 0
+        self._next = 0  # row the next add writes (wraps to 0 once max_entries rows exist)
+        self.version = ""  # knowledge-base version the live entries were built against
+        self._loaded = False
+
+    def clear(self, version: str | None = None) -> None:
+        self.E, self.entries, self.n, self._next = None, [], 0, 0
+        if version is not None:
+            self.version = version
+        self._loaded = True  # don't reload answers persisted before this change
+
+    def lookup(self, qvec: np.ndarray) -> dict[str, Any] | None:
+        """Result stored for the most similar question, if above threshold and not expired."""
+        self._ensure_loaded()
+        if not self.n or self.E.shape[1] != qvec.shape[0]:
+            return None
+        sims = self.E[: self.n] @ qvec
+        best = int(sims.argmax())
+        stored_at, result = self.entries[best]
+        if sims[best] < self.threshold or time.time() - stored_at > self.ttl:
+            return None
+        return result
+
+    def add(self, qvec: np.ndarray, result: dict[str, Any], version: str) -> None:
+        """Store result for qvec; dropped if it was built against another knowledge-base version."""
+        self._ensure_loaded()
+        if version != self.version:
+            return
+        if self.E is None or self.E.shape[1] != qvec.shape[0]:
+            self.clear()
+            self.E = np.empty((min(self.BLOCK, self.max_entries), qvec.shape[0]), dtype=np.float32)
+        elif self._next == len(self.E) and len(self.E) < self.max_entries:
+            grown = np.empty((min(len(self.E) + self.BLOCK, self.max_entries), self.E.shape[1]), dtype=np.float32)
+            grown[: self.n] = self.E[: self.n]
+            self.E = grown
+        if self._next == self.max_entries:
+            self._next = 0
+        i = self._next
+        self.E[i] = qvec
+        entry = (time.time(), result)
+        if i < len(self.entries):
+            self.entries[i] = entry
+        else:
+            self.entries.append(entry)
+        self._next += 1
+        self.n = max(self.n, self._next)
+
+    def snapshot(self) -> tuple[np.ndarray, list, str] | None:
+        """(float16 rows, entries, version) oldest first, for save(); None if never loaded (the file is current)."""
+        if not self._loaded:
+            return None
+        if not self.n:
+            return np.zeros((0, 0), dtype=np.float16), [], self.version
+        order = np.r_[self._next : self.n, 0 : self._next]
+        return self.E[order].astype(np.float16), [self.entries[i] for i in order], self.version
+
+    def save(self, vectors: np.ndarray, entries: list, version: str) -> None:
+        """Write one .npz via a temp file + os.replace, so readers never see half of one save and half of another."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                vectors=vectors,
+                entries=np.frombuffer(json.dumps(entries).encode("utf-8"), dtype=np.uint8),
+                version=np.array(version),
+            )
+        os.replace(tmp, self.path)
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        self.version = _read_kb_version()
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["version"]) != self.version:
+                    return  # the knowledge base changed after these answers were saved
+                vectors = data["vectors"]
+                entries = [(float(t), r) for t, r in json.loads(data["entries"].tobytes())]
+        except (OSError, ValueError, KeyError):
+            return
+        if vectors.ndim != 2 or not len(entries) or len(entries) != len(vectors):
+            return
+        keep = min(len(entries), self.max_entries)
+        self.E = vectors[-keep:].astype(np.float32)
+        self.entries = entries[-keep:]
+        self.n = self._next = keep
+
+
+def _read_kb_version() -> str:
+    try:
+        with open(KB_VERSION_PATH, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _bump_kb_version() -> str:
+    """Record a knowledge-base change for every process (atomic rewrite); returns the new version."""
+    version = os.urandom(8).hex()
+    os.makedirs(os.path.dirname(KB_VERSION_PATH) or ".", exist_ok=True)
+    tmp = f"{KB_VERSION_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, KB_VERSION_PATH)
+    return version
+
+
+SEMANTIC_CACHE = SemanticCache(SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_THRESHOLD, QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+
+def clear_query_cache() -> None:
+    global _cache_generation
+    version = _bump_kb_version()  # file write outside the lock the event loop takes for lookups
+    with QUERY_CACHE_LOCK:
+        _cache_generation += 1
+        QUERY_CACHE.clear()
+        SEMANTIC_CACHE.clear(version)
+
+
+def load_semantic_cache() -> None:
+    """Read the persisted semantic tier now (API startup, in a worker thread) rather than on the first query."""
+    with QUERY_CACHE_LOCK:
+        SEMANTIC_CACHE._ensure_loaded()
+
+
+def save_semantic_cache() -> None:
+    """
+    Persist the semantic tier (called on API shutdown). Skipped if another process changed the
+    knowledge base since these answers were built, so a stale cache never replaces a current one.
+    """
+    with QUERY_CACHE_LOCK:
+        snapshot = SEMANTIC_CACHE.snapshot()
+    if snapshot is not None and snapshot[2] == _read_kb_version():
+        SEMANTIC_CACHE.save(*snapshot)
+
+
+def _unit(vec: list[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else v
+
+
+def _cached_answer(key: bytes, qvec: np.ndarray | None = None) -> dict[str, Any] | None:
+    """Exact-tier hit for key, else (if qvec given) the best semantic-tier hit above the threshold."""
+    with QUERY_CACHE_LOCK:
+        hit = QUERY_CACHE.get(key)
+        if hit is not None or qvec is None:
+            return hit
+        hit = SEMANTIC_CACHE.lookup(qvec)
+        if hit is not None:
+            QUERY_CACHE[key] = hit
+        return hit
+
+
+def _remember_answer(key: bytes, qvec: np.ndarray, result: dict[str, Any], generation: int, version: str) -> None:
+    """
+    Cache result, unless the knowledge base changed since generation / the semantic tier's
+    version were read (before retrieval); a stale row would otherwise be saved under the new version.
+    """
+    with QUERY_CACHE_LOCK:
+        if generation != _cache_generation:
+            return
+        QUERY_CACHE[key] = result
+        SEMANTIC_CACHE.add(qvec, result, version)
+
+
+# Truncated vectors aren't unit-length; _unit_rows restores that (the cosine conversion in query_collection relies on it).
+_EMBED_OPTIONS = {"output_dimensionality": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+
+
+def _embed_cache_key(text: str) -> str:
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\x00{EMBEDDING_DIMENSIONS}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def _unit_rows(vectors: list[list[float]]) -> list[list[float]]:
+    m = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return (m / np.where(norms == 0, 1, norms)).tolist()
 
 
 def get_embedding(text: str) -> list[float]:
-    """Single text -> embedding via Gemini."""
+    """Single text -> embedding via Gemini (served from the on-disk embedding cache when possible)."""
+    key = _embed_cache_key(text)
+    if _embed_cache is not None:
+        cached = _embed_cache.get(key)
+        if cached is not None:
+            return cached
+    emb = _embed_one(text)
+    if _embed_cache is not None:
+        _embed_cache.set(key, emb)
+    return emb
+
+
+def _embed_one(text: str) -> list[float]:
     configure_gemini()
-    result = genai.embed_content(model=EMBEDDING_MODEL, content=text)
+    result = genai.embed_content(model=EMBEDDING_MODEL, content=text, **_EMBED_OPTIONS)
     if "embedding" in result:
-        return result["embedding"]
+        return _unit_rows([result["embedding"]])[0]
     if "embeddings" in result and result["embeddings"]:
         emb = result["embeddings"]
-        return emb[0] if isinstance(emb, list) else emb
+        return _unit_rows([emb[0] if isinstance(emb, list) else emb])[0]
     raise ValueError("Unexpected embed_content result shape")
 
 
+def _embed_batch(texts: list[str]) -> list[list[float]]:
+    """
+    One batch_embed_contents round-trip for texts. Only a rejected request (payload over the size or
+    item limit) falls back to one call per text; rate limits, auth and network errors propagate, so a
+    429 doesn't turn into a burst of single requests.
+    """
+    try:
+        # A list `content` makes the SDK issue batchEmbedContents instead of N embedContent calls.
+        result = genai.embed_content(model=EMBEDDING_MODEL, content=list(texts), **_EMBED_OPTIONS)
+    except google_exceptions.InvalidArgument:
+        return [_embed_one(t) for t in texts]
+    embeddings = result["embedding"]
+    if len(embeddings) != len(texts):
+        raise ValueError("Unexpected batch embed_content result shape")
+    return _unit_rows(embeddings)
+
+
+def _embed_batches(texts: list[str]) -> list[list[int]]:
+    """Group text indices, shortest first, into batches of <= EMBED_BATCH_SIZE items / ~EMBED_BATCH_TOKENS tokens."""
+    batches: list[list[int]] = []
+    current: list[int] = []
+    tokens = 0
+    for i in sorted(range(len(texts)), key=lambda i: len(texts[i])):
+        est = len(texts[i]) // 4 + 1
+        if current and (len(current) >= EMBED_BATCH_SIZE or tokens + est > EMBED_BATCH_TOKENS):
+            batches.append(current)
+            current, tokens = [], 0
+        current.append(i)
+        tokens += est
+    if current:
+        batches.append(current)
+    return batches
+
+
+# Shared across callers so concurrent ingests together never exceed MAX_EMBED_CONCURRENCY requests.
+_embed_pool = ThreadPoolExecutor(max_workers=max(1, MAX_EMBED_CONCURRENCY), thread_name_prefix="embed")
+
+
 def get_embeddings(texts: list[str]) -> list[list[float]]:
-    """Batch embed (one API call per item for Gemini; can be optimized later)."""
-    return [get_embedding(t) for t in texts]
+    """Batch embed: cached vectors from disk, the rest fetched in concurrent mini-batches; input order kept."""
+    if not texts:
+        return []
+    if _embed_cache is None:
+        return _fetch_embeddings(texts)
+    keys = [_embed_cache_key(t) for t in texts]
+    out = [_embed_cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(out) if v is None]
+    if missing:
+        fetched = _fetch_embeddings([texts[i] for i in missing])
+        for i, vec in zip(missing, fetched):
+            out[i] = vec
+            _embed_cache.set(keys[i], vec)
+    return out
+
+
+def _fetch_embeddings(texts: list[str]) -> list[list[float]]:
+    """Length-sorted mini-batches sent concurrently to Gemini, results in input order."""
+    configure_gemini()
+    batches = _embed_batches(texts)
+    if len(batches) == 1:
+        return _embed_batch(list(texts))
+    futures = []
+    for n, batch in enumerate(batches):
+        if n:
+            time.sleep(random.uniform(0, 0.05))  # jitter so batches don't hit the API (and 429s) in lockstep
+        futures.append((batch, _embed_pool.submit(_embed_batch, [texts[i] for i in batch])))
+    out: list[list[float]] = [[] for _ in texts]
+    for batch, future in futures:
+        for i, vec in zip(batch, future.result()):
+            out[i] = vec
+    return out
 
 
 class GeminiEmbeddingFunction:
@@ -101,137 +430,444 @@ class GeminiEmbeddingFunction:
 
 
 def get_chroma_client():
-    """Persistent Chroma client."""
-    os.makedirs(CHROMA_PATH, exist_ok=True)
-    return chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
+    """Persistent Chroma client (shared)."""
+    global _chroma_client
+    if _chroma_client is None:
+        with _collection_lock:
+            if _chroma_client is None:
+                os.makedirs(CHROMA_PATH, exist_ok=True)
+                _chroma_client = chromadb.PersistentClient(path=CHROMA_PATH, settings=_CHROMA_SETTINGS)
+    return _chroma_client
 
 
-def get_collection():
-    """Get or create the RAG collection with Gemini embeddings."""
-    configure_gemini()
+def get_collection(check_dimensions: bool = True):
+    """
+    Get or create the RAG collection with Gemini embeddings (opened once, reused until clear_collection).
+    Raises ValueError if it holds vectors of another EMBEDDING_DIMENSIONS (see collection_dimensions),
+    unless check_dimensions is False (reingest_all_sources, which rebuilds it).
+    """
+    coll = _collection
+    if coll is None:
+        coll = _open_collection()
+    if check_dimensions:
+        _check_dimensions(coll)
+    return coll
+
+
+_T = TypeVar("_T")
+
+
+def with_collection(op: Callable[[Any], _T], check_dimensions: bool = True) -> _T:
+    """
+    op(get_collection()). If the cached handle went stale (another process ran clear_collection, so
+    Chroma no longer knows its id), reopen the collection and run op once more on the new handle.
+    """
+    coll = get_collection(check_dimensions)
+    try:
+        return op(coll)
+    except NotFoundError:
+        _forget_collection(coll)
+        return op(get_collection(check_dimensions))
+
+
+def _forget_collection(coll) -> None:
+    """Drop the cached handle if it is still coll, so the next get_collection() reopens by name."""
+    global _collection
+    with _collection_lock:
+        if _collection is coll:
+            _collection = None
+
+
+def collection_dimensions(coll) -> int:
+    """EMBEDDING_DIMENSIONS the collection was built with; collections from before the setting are full size (0)."""
+    return (coll.metadata or {}).get("embedding_dimensions", 0)
+
+
+def _check_dimensions(coll) -> None:
+    stored = collection_dimensions(coll)
+    if stored != EMBEDDING_DIMENSIONS:
+        held = f"{stored}-dimensional" if stored else "full-size (3072-dimensional)"
+        raise ValueError(
+            f"Chroma collection {CHROMA_COLLECTION_NAME!r} holds {held} embeddings but "
+            f"EMBEDDING_DIMENSIONS is {EMBEDDING_DIMENSIONS}; re-ingest required "
+            "(PUT /knowledge or ingest.reingest_all_sources(force=True))."
+        )
+
+
+def _open_collection():
+    global _collection
     client = get_chroma_client()
-    return client.get_or_create_collection(
-        name=CHROMA_COLLECTION_NAME,
-        embedding_function=GeminiEmbeddingFunction(),
-        metadata={"description": "RAG chunks"},
-    )
+    with _collection_lock:
+        if _collection is None:
+            configure_gemini()
+            coll = client.get_or_create_collection(
+                name=CHROMA_COLLECTION_NAME,
+                embedding_function=GeminiEmbeddingFunction(),
+                metadata={
+                    "description": "RAG chunks",
+                    "embedding_dimensions": EMBEDDING_DIMENSIONS,
+                    "hnsw:space": HNSW_SPACE,
+                    "hnsw:M": HNSW_M,
+                    "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+                    "hnsw:search_ef": HNSW_SEARCH_EF,
+                    "hnsw:num_threads": os.cpu_count() or 1,
+                },
+            )
+            _scale_search_ef(coll)
+            _collection = coll
+        return _collection
+
+
+def _scale_search_ef(coll) -> None:
+    """
+    Apply auto_search_ef for the collection's current size, if enabled. search_ef is persisted
+    collection config shared by every process, so it is written only when the stored value differs.
+    """
+    if HNSW_AUTO_SEARCH_EF:
+        ef = auto_search_ef(coll.count())
+        if ef != _stored_search_ef(coll):
+            _set_search_ef(coll, ef)
+
+
+def auto_search_ef(n_vectors: int) -> int:
+    """HNSW search_ef for a collection of n_vectors: wider candidate lists as the graph grows."""
+    if n_vectors < 100_000:
+        return 40
+    if n_vectors < 1_000_000:
+        return 100
+    return 200
+
+
+def _set_search_ef(coll, ef: int) -> bool:
+    """Change the collection's HNSW search_ef in place. False if this Chroma build can't."""
+    try:
+        coll.modify(configuration={"hnsw": {"ef_search": ef}})
+    except Exception:
+        # Chroma < 1.0 takes HNSW settings as metadata (which modify replaces wholesale and
+        # which may not include the immutable hnsw:space).
+        try:
+            meta = {k: v for k, v in (coll.metadata or {}).items() if k != "hnsw:space"}
+            coll.modify(metadata={**meta, "hnsw:search_ef": ef})
+        except Exception:
+            return False
+    return True
+
+
+def _stored_search_ef(coll) -> int | None:
+    """HNSW search_ef the collection currently has persisted (None if Chroma doesn't report one)."""
+    try:
+        ef = (coll.configuration.get("hnsw") or {}).get("ef_search")
+    except Exception:
+        ef = None
+    return ef if ef is not None else (coll.metadata or {}).get("hnsw:search_ef")
+
+
+def _collection_space(coll) -> str:
+    """Distance function of the collection's HNSW index ("l2" if Chroma doesn't report one)."""
+    try:
+        space = (coll.configuration.get("hnsw") or {}).get("space")
+    except Exception:
+        space = None
+    return space or (coll.metadata or {}).get("hnsw:space") or "l2"
 
 
 def clear_collection():
     """Delete the RAG collection. Next get_collection() will create a new empty one."""
+    global _collection
     client = get_chroma_client()
-    try:
-        client.delete_collection(name=CHROMA_COLLECTION_NAME)
-    except Exception:
-        pass
+    with _collection_lock:
+        try:
+            client.delete_collection(name=CHROMA_COLLECTION_NAME)
+        except Exception:
+            pass
+        _collection = None
+    clear_query_cache()
 
 
 def delete_chunks_by_source(source_value: str) -> None:
     """Delete all chunks whose metadata 'source' equals source_value."""
-    coll = get_collection()
     try:
-        coll.delete(where={"source": {"$eq": source_value}})
+        with_collection(lambda coll: coll.delete(where={"source": {"$eq": source_value}}))
     except Exception:
         pass
+    clear_query_cache()
+
+
+# Max ids per collection.delete(ids=...) call
+_ID_BATCH = 1000
+
+
+def delete_stale_chunks(source_value: str, keep_ids: set[str]) -> None:
+    """Delete chunks of source_value whose ids are not in keep_ids (after upserting its new chunks)."""
+    try:
+        existing = with_collection(lambda coll: coll.get(where={"source": {"$eq": source_value}}, include=[])["ids"])
+    except Exception:
+        return
+    stale = [i for i in existing if i not in keep_ids]
+    for n in range(0, len(stale), _ID_BATCH):
+        with_collection(lambda coll: coll.delete(ids=stale[n : n + _ID_BATCH]))
+    if stale:
+        clear_query_cache()
+
+
+def replace_source_chunks(source_value: str, chunks: list[str], metadatas: list[dict[str, Any]]) -> int:
+    """
+    Make chunks the whole content of source_value: upsert them (unchanged chunks keep their id and
+    stored embedding), then delete only the source's chunks that are no longer present. Returns len(chunks).
+    """
+    if not chunks:
+        delete_chunks_by_source(source_value)
+        return 0
+    ids = [chunk_id(source_value, c) for c in chunks]
+    add_chunks_to_collection(chunks, metadatas=metadatas, ids=ids)
+    delete_stale_chunks(source_value, set(ids))
+    return len(chunks)
+
+
+def chunk_hash(text: str) -> str:
+    """Content hash stored as chunk metadata 'hash' (xxh3 when available, else blake2b)."""
+    data = text.encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+# Max hashes per collection.get(where={"hash": {"$in": ...}}) lookup
+_HASH_LOOKUP_BATCH = 256
+
+
+def _embeddings_reusing_duplicates(coll, chunks: list[str], hashes: list[str]) -> list[list[float]]:
+    """
+    Embeddings for chunks, calling Gemini only for text not already in the collection (or repeated in this batch).
+    Duplicates are still stored per source, so deleting one source never removes another's text.
+    """
+    known: dict[str, list[float]] = {}
+    unique = list(dict.fromkeys(hashes))
+    for i in range(0, len(unique), _HASH_LOOKUP_BATCH):
+        batch = unique[i : i + _HASH_LOOKUP_BATCH]
+        try:
+            found = coll.get(where={"hash": {"$in": batch}}, include=["metadatas", "embeddings"])
+        except Exception:
+            continue
+        embs = found.get("embeddings")
+        if embs is None:
+            continue
+        for meta, emb in zip(found.get("metadatas") or [], embs):
+            if meta and meta.get("hash"):
+                known.setdefault(meta["hash"], list(emb))
+    missing = {h: c for h, c in zip(hashes, chunks) if h not in known}
+    if missing:
+        known.update(zip(missing, get_embeddings(list(missing.values()))))
+    return [known[h] for h in hashes]
+
+
+def chunk_id(source: str, text: str) -> str:
+    """Deterministic chunk id: the same text from the same source always maps to the same Chroma id."""
+    return hashlib.blake2b(f"{source}|{text}".encode("utf-8"), digest_size=16).hexdigest()
 
 
 def add_chunks_to_collection(chunks: list[str], metadatas: list[dict[str, Any]] | None = None, ids: list[str] | None = None):
-    """Add chunk texts (and optional metadatas/ids) to Chroma. IDs default to chunk index."""
+    """
+    Upsert chunk texts (and optional metadatas/ids) into Chroma. IDs default to chunk_id(source, text),
+    so re-ingesting unchanged content overwrites instead of duplicating; repeats within the batch are dropped.
+    """
     if not chunks:
         return
-    coll = get_collection()
-    if ids is None:
-        import uuid
-        ids = [str(uuid.uuid4()) for _ in chunks]
     if metadatas is None:
         metadatas = [{}] * len(chunks)
-    # Chroma metadata values must be str, int, float, or bool
-    safe_metadatas = []
-    for m in metadatas:
-        safe = {}
-        for k, v in m.items():
-            if v is None:
-                continue
-            if isinstance(v, (str, int, float, bool)):
-                safe[k] = v
-            else:
-                safe[k] = str(v)
-        safe_metadatas.append(safe)
-    coll.add(documents=chunks, metadatas=safe_metadatas, ids=ids)
-
-
-def query_collection(query_text: str, n_results: int = TOP_K):
-    """Return top-n chunks with metadata and distances (lower = more similar)."""
-    coll = get_collection()
-    result = coll.query(
-        query_texts=[query_text],
-        n_results=min(n_results, 100),
-        include=["documents", "metadatas", "distances"],
-    )
+    if ids is None:
+        ids = [chunk_id(str(m.get("source") or ""), c) for c, m in zip(chunks, metadatas)]
+    if len(set(ids)) < len(ids):
+        first: dict[str, int] = {}
+        for n, i in enumerate(ids):
+            first.setdefault(i, n)
+        keep = list(first.values())
+        chunks = [chunks[n] for n in keep]
+        metadatas = [metadatas[n] for n in keep]
+        ids = [ids[n] for n in keep]
+    hashes = [chunk_hash(c) for c in chunks]
+    safe_metadatas = sanitize_metadatas(metadatas, hashes)
+
+    def upsert(coll) -> None:
+        embeddings = _embeddings_reusing_duplicates(coll, chunks, hashes)
+        coll.upsert(documents=chunks, metadatas=safe_metadatas, ids=ids, embeddings=embeddings)
+        _scale_search_ef(coll)  # the collection is no longer reopened, so re-check its size step here
+
+    with_collection(upsert)
+    clear_query_cache()
+
+
+def _distance_to_cosine(d: np.ndarray, space: str) -> np.ndarray:
+    """
+    Chroma (hnswlib) distances -> cosine similarity: "cosine" and "ip" report 1 - dot, "l2" reports
+    squared L2. Gemini embeddings are unit-length, so dot = cos and L2^2 = 2(1 - cos).
+    """
+    if space == "l2":
+        return 1.0 - 0.5 * d
+    return 1.0 - d
+
+
+def query_collection(
+    query_text: str,
+    n_results: int = TOP_K,
+    query_embedding: list[float] | None = None,
+):
+    """
+    Return top-n chunks with metadata and cosine similarity, best first (higher = more similar).
+    Chroma is always queried by vector; pass query_embedding to reuse one the caller already has,
+    otherwise query_text is embedded through the cached get_embedding.
+    """
+    if query_embedding is None:
+        configure_gemini()
+        query_embedding = get_embedding(query_text)
+    n_results = min(n_results, 100)
+
+    def search(coll) -> tuple[dict, str]:
+        result = coll.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            include=["documents", "metadatas", "distances"],
+        )
+        return result, _collection_space(coll)
+
+    result, space = with_collection(search)
     docs = result["documents"][0] if result["documents"] else []
     metas = result["metadatas"][0] if result["metadatas"] else []
     dists = result["distances"][0] if result["distances"] else []
-    # Chroma returns L2 distance; convert to similarity-like (0 = best). We use 1/(1+d) as proxy for similarity for thresholding.
-    return list(zip(docs, metas, dists))
+    if not dists:
+        return []
+    d = np.asarray(dists, dtype=np.float32)
+    cos = _distance_to_cosine(d, space)
+    order = np.argsort(-cos, kind="stable")[:n_results].tolist()
+    cos = cos.tolist()
+    return [(docs[i], metas[i], cos[i]) for i in order]
+
+
+_PROMPT = """Answer the question using ONLY the context below. If the context does not contain enough information, say: "I don't have enough information in the knowledge base to answer that."
+Do not guess or use external knowledge. Keep the answer concise. If possible, quote the relevant part of the context.
+
+Context:
+{context}
+
+Question:
+{question}
+"""
+
+
+def _context_chunks(results: list, budget: int = PROMPT_TOKEN_BUDGET) -> tuple[list[str], list[dict[str, str]]]:
+    """
+    Chunks for the prompt in rank order plus their source labels, in one pass. Near-duplicates (same
+    first 200 chars) are skipped, and it stops once the ~len/4 token estimate would pass budget.
+    The best chunk is always kept.
+    """
+    kept: list[str] = []
+    sources: list[dict[str, str]] = []
+    seen: set[bytes] = set()
+    used = 0
+    for i, (doc, meta, _) in enumerate(results):
+        doc = doc or ""
+        head = doc[:200]
+        digest = hashlib.md5(head.encode("utf-8"), usedforsecurity=False).digest()
+        if digest in seen:
+            continue
+        tokens = len(doc) // 4
+        if kept and used + tokens > budget:
+            break
+        seen.add(digest)
+        used += tokens
+        kept.append(doc)
+        meta = meta or {}
+        label = meta.get("source") or meta.get("url") or meta.get("filename") or f"Chunk {i+1}"
+        sources.append({"text": head + "..." if len(doc) > 200 else doc, "source": str(label)})
+    return kept, sources
 
 
 def query_rag(question: str) -> dict[str, Any]:
+    """Sync wrapper around aquery_rag for the CLI and other non-async callers."""
+    return asyncio.run(aquery_rag(question))
+
+
+async def aquery_rag(question: str) -> dict[str, Any]:
+    """Run RAG and return the whole answer and its sources (astream_rag, concatenated; an error replaces it)."""
+    parts: list[str] = []
+    sources: list[dict[str, str]] = []
+    async for event in astream_rag(question):
+        if "sources" in event:
+            sources = event["sources"]
+        elif "error" in event:
+            parts = [event["error"]]
+        else:
+            parts.append(event["delta"])
+    return {"answer": "".join(parts).strip(), "sources": sources}
+
+
+async def astream_rag(question: str) -> AsyncIterator[dict[str, Any]]:
     """
-    Run RAG: retrieve top chunks, build prompt, call Groq. Return answer and sources.
-    If retrieval is below threshold, return a safe "I don't have enough information" answer.
+    Run RAG: retrieve top chunks, build prompt, stream the Groq answer. Yields {"sources": [...]} once,
+    then {"delta": "..."} pieces of the answer as they are generated. If generation fails partway,
+    a final {"error": "..."} replaces whatever was streamed so far.
+    If retrieval is below threshold, the answer is a safe "I don't have enough information" message.
+    Embedding and Chroma search run in worker threads; the Groq stream is read on AsyncGroq,
+    so no thread is held while the answer is generated.
     """
     question = (question or "").strip()
     if not question:
-        return {"answer": "Please ask a question.", "sources": []}
+        yield {"sources": []}
+        yield {"delta": "Please ask a question."}
+        return
 
-    configure_gemini()
-    groq = get_groq_client()
+    key = query_cache_key(question)
+    generation = _cache_generation
+    cached = _cached_answer(key)
+    if cached is None:
+        configure_gemini()
+        groq = get_async_groq_client()
+
+        # anyio worker threads share the API's raised thread limit (asyncio.to_thread's default executor is capped at 32).
+        embedding = await anyio.to_thread.run_sync(get_embedding, question)
+        qvec = _unit(embedding)
+        cached = _cached_answer(key, qvec)
+    version = SEMANTIC_CACHE.version  # loaded by the lookup above
+    if cached is not None:
+        yield {"sources": cached["sources"]}
+        yield {"delta": cached["answer"]}
+        return
 
-    results = query_collection(question, n_results=TOP_K)
+    results = await anyio.to_thread.run_sync(query_collection, question, TOP_K, embedding)
     if not results:
-        return {
-            "answer": "I couldn't find any relevant information in the knowledge base to answer that.",
-            "sources": [],
-        }
-
-    # Chroma L2 distance: lower is better. Use first result's distance as "best". Threshold in L2 terms (e.g. > 1.5 = weak).
-    best_distance = results[0][2] if results else float("inf")
-    # Heuristic: if best distance is high, consider it no match (depends on embedding scale)
-    if best_distance > 2.0:  # tune as needed for Gemini embedding scale
-        return {
-            "answer": "I couldn't find relevant information in the knowledge base for that question.",
-            "sources": [],
-        }
-
-    top_chunks = [r[0] or "" for r in results]
-    metadatas = [r[1] or {} for r in results]
-    context = "\n\n".join(top_chunks)
-    source_labels = []
-    for i, meta in enumerate(metadatas):
-        if not isinstance(meta, dict):
-            meta = {}
-        label = meta.get("source") or meta.get("url") or meta.get("filename") or f"Chunk {i+1}"
-        chunk_text = top_chunks[i] if i < len(top_chunks) else ""
-        snippet = (chunk_text[:200] + "...") if len(chunk_text) > 200 else chunk_text
-        source_labels.append({"text": snippet, "source": str(label)})
+        yield {"sources": []}
+        yield {"delta": "I couldn't find any relevant information in the knowledge base to answer that."}
+        return
 
-    prompt = f"""Answer the question using ONLY the context below. If the context does not contain enough information, say: "I don't have enough information in the knowledge base to answer that."
-Do not guess or use external knowledge. Keep the answer concise. If possible, quote the relevant part of the context.
+    # Results are sorted by cosine similarity; if even the best chunk is weak, treat it as no match.
+    if results[0][2] < SIMILARITY_THRESHOLD:
+        yield {"sources": []}
+        yield {"delta": "I couldn't find relevant information in the knowledge base for that question."}
+        return
 
-Context:
-{context}
+    top_chunks, source_labels = _context_chunks(results)
+    yield {"sources": source_labels}
 
-Question:
-{question}
-"""
+    prompt = _PROMPT.format(context="\n\n".join(top_chunks), question=question)
 
+    parts: list[str] = []
     try:
-        response = groq.chat.completions.create(
+        stream = await groq.chat.completions.create(
             model=GENERATION_MODEL,
             messages=[{"role": "user", "content": prompt}],
+            stream=True,
         )
-        answer = (response.choices[0].message.content or "").strip() if response.choices else ""
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield {"delta": delta}
     except Exception as e:
-        answer = f"Sorry, an error occurred while generating an answer: {str(e)}"
+        yield {"error": f"Sorry, an error occurred while generating an answer: {str(e)}"}
+        return
 
-    return {"answer": answer or "I couldn't generate an answer.", "sources": source_labels}
+    answer = "".join(parts).strip()
+    if not answer:
+        yield {"delta": "I couldn't generate an answer."}
+        return
+    _remember_answer(key, qvec, {"answer": answer, "sources": source_labels}, generation, version)
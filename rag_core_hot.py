@@ -0,0 +1,98 @@
+"""
+Per-chunk hot paths of ingestion (chunking, metadata sanitization), kept free of I/O and fully
+annotated so the module can be compiled with mypyc (see STEPS.md); plain Python otherwise.
+"""
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+
+from config import CHUNK_SIZE, CHUNK_OVERLAP
+
+_SCALAR = (str, int, float, bool)
+
+
+def _is_single_spaced(buf: np.ndarray, ascii_only: bool) -> bool:
+    """
+    True if UTF-8 bytes already look like " ".join(text.split()): no leading/trailing/double spaces and
+    no whitespace other than 0x20 (ASCII controls, and for non-ASCII text the multi-byte Unicode spaces).
+    """
+    low = buf <= 0x20
+    if buf[0] == 0x20 or buf[-1] == 0x20 or (low & (buf != 0x20)).any() or (low[1:] & low[:-1]).any():
+        return False
+    if ascii_only or len(buf) < 2:
+        return True
+    b0, b1 = buf[:-1], buf[1:]
+    if ((b0 == 0xC2) & ((b1 == 0x85) | (b1 == 0xA0))).any():  # U+0085, U+00A0
+        return False
+    b0, b1, b2 = buf[:-2], buf[1:-1], buf[2:]
+    u2000 = (b0 == 0xE2) & (b1 == 0x80) & (((b2 >= 0x80) & (b2 <= 0x8A)) | (b2 == 0xA8) | (b2 == 0xA9) | (b2 == 0xAF))
+    other = (
+        ((b0 == 0xE1) & (b1 == 0x9A) & (b2 == 0x80))  # U+1680
+        | ((b0 == 0xE2) & (b1 == 0x81) & (b2 == 0x9F))  # U+205F
+        | ((b0 == 0xE3) & (b1 == 0x80) & (b2 == 0x80))  # U+3000
+    )
+    return not (u2000 | other).any()
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list[str]:
+    """Split text into chunks with optional overlap. Prefer word boundaries."""
+    # Chunks are words joined by single spaces. Once text is in that form every word boundary is one
+    # 0x20 byte, so boundaries come from one vectorized scan instead of a Python word list. Text from
+    # PDF/DOCX/URL extraction is already single-spaced; anything else is normalized once first.
+    text = text or ""
+    data = text.encode("utf-8")
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if not len(buf) or not _is_single_spaced(buf, text.isascii()):
+        data = " ".join(text.split()).encode("utf-8")
+        if not data:
+            return []
+        buf = np.frombuffer(data, dtype=np.uint8)
+    spaces = np.flatnonzero(buf == 0x20)
+    n_words = len(spaces) + 1
+    step = max(1, chunk_size - overlap)
+    # Chunk i covers words [i*step, i*step + chunk_size); the last chunk is the first one reaching the end.
+    first = np.arange(0, max(1, n_words - chunk_size + step), step)
+    last = np.minimum(first + chunk_size, n_words) - 1
+    starts = np.concatenate(([0], spaces + 1))[first].tolist()
+    ends = np.append(spaces, len(data))[last].tolist()
+    # UTF-8 never uses 0x20 inside a multi-byte sequence, so these byte slices decode cleanly.
+    return [data[a:b].decode("utf-8") for a, b in zip(starts, ends)]
+
+
+def iter_chunks(pieces: Iterable[str], chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """
+    Streaming chunk_text: yields the same chunks as chunk_text("".join(pieces)) while only holding
+    the current piece plus one chunk of carried-over words. Pieces may split words anywhere.
+    """
+    step = max(1, chunk_size - overlap)
+    buf: list[str] = []
+    carry = ""
+    for piece in pieces:
+        piece = carry + piece
+        words = piece.split()
+        carry = words.pop() if words and not piece[-1].isspace() else ""
+        buf.extend(words)
+        i = 0
+        while len(buf) - i > chunk_size:
+            yield " ".join(buf[i : i + chunk_size])
+            i += step
+        del buf[:i]
+    if carry:
+        buf.append(carry)
+    i = 0
+    while len(buf) - i > chunk_size:
+        yield " ".join(buf[i : i + chunk_size])
+        i += step
+    if buf[i:]:
+        yield " ".join(buf[i:])
+
+
+def sanitize_metadatas(metadatas: list[dict[str, Any]], hashes: list[str]) -> list[dict[str, Any]]:
+    """
+    Chroma-safe copies of metadatas (values must be str, int, float, or bool: None dropped, others
+    stringified), each with its chunk's content hash under "hash".
+    """
+    safe_metadatas = [{k: (v if isinstance(v, _SCALAR) else str(v)) for k, v in m.items() if v is not None} for m in metadatas]
+    for m, h in zip(safe_metadatas, hashes):
+        m["hash"] = h
+    return safe_metadatas